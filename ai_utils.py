@@ -1,171 +1,1355 @@
 # ai_utils.py
 
-from openai import OpenAI
+import openai
+from openai import OpenAI, AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from functools import lru_cache
+import asyncio
+import hashlib
+import json
+import os
 import re
+import sqlite3
+import sys
+import threading
+import time
 import logging
+import numpy as np
 import streamlit as st
 
-def generate_pico_from_title(title):
+# Model used for all completions. The structured-extraction prompts here work
+# well on the smaller model at a fraction of the latency and cost; override
+# with the PICO_MODEL environment variable if needed.
+MODEL = os.getenv("PICO_MODEL", "gpt-4o-mini")
+
+# Version tag for the prompts below. It participates in the cache key of the
+# memoized generators, so bumping it invalidates cached responses whenever a
+# prompt is edited.
+PROMPT_VERSION = "v3"
+
+# Cached responses are kept for a week; identical inputs within that window
+# return in microseconds instead of paying a full model round-trip.
+_CACHE_TTL = 7 * 24 * 3600
+
+# Above this many titles, bulk PICO generation should go through the Batch
+# API (submit_pico_batch / fetch_pico_batch) rather than a single synchronous
+# batched prompt.
+BATCH_API_THRESHOLD = 8
+
+# Bound the number of in-flight async requests so concurrent calls stay
+# within OpenAI rate limits.
+_MAX_CONCURRENT_REQUESTS = 10
+
+# asyncio primitives bind to the event loop that first awaits them, and each
+# asyncio.run call creates a fresh loop, so the semaphore is kept per loop.
+_loop_semaphores = {}
+
+def _get_request_semaphore():
+    """
+    Returns the shared request semaphore for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _loop_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+        _loop_semaphores[loop] = semaphore
+    return semaphore
+
+# Client-side rate limits, matched to the account's OpenAI quota via env vars.
+_MAX_RPM = int(os.getenv("MAX_RPM", "500"))
+_MAX_TPM = int(os.getenv("MAX_TPM", "200000"))
+
+class _TokenBucket:
+    """
+    Client-side request/token rate limiter shared by the async helpers.
+
+    Capacity refills continuously at the configured per-minute rates. A call
+    waits until a request slot and its estimated token cost are both
+    available, so concurrent fan-out stays under the account's RPM/TPM quota
+    instead of tripping server-side 429s whose backoff sleeps dominate wall
+    time.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_capacity = float(rpm)
+        self.token_capacity = float(tpm)
+        self.last_refill = time.monotonic()
+        # The bucket is a module global shared by every session thread's
+        # event loop, so refill-and-take is a cross-thread read-modify-write
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens):
+        """
+        Blocks until one request slot and the given token estimate are free.
+
+        Each Streamlit session thread runs its own event loop against this
+        shared bucket, so the refill-and-take block runs under a plain
+        threading.Lock. It contains no awaits, so the lock is only held for
+        the arithmetic and never across a suspension point, which also keeps
+        the bucket usable across successive asyncio.run loops.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self.last_refill
+                self.last_refill = now
+                self.request_capacity = min(
+                    self.rpm, self.request_capacity + self.rpm * elapsed / 60.0
+                )
+                self.token_capacity = min(
+                    self.tpm, self.token_capacity + self.tpm * elapsed / 60.0
+                )
+                if self.request_capacity >= 1 and self.token_capacity >= tokens:
+                    self.request_capacity -= 1
+                    self.token_capacity -= tokens
+                    return
+            await asyncio.sleep(0.05)
+
+_RATE_LIMITER = _TokenBucket(_MAX_RPM, _MAX_TPM)
+
+def _estimate_request_tokens(kwargs):
+    """
+    Rough token estimate for a completion request: ~4 characters per prompt
+    token, plus the full output budget.
+    """
+    prompt_chars = sum(len(m.get("content", "")) for m in kwargs.get("messages", []))
+    return prompt_chars // 4 + kwargs.get("max_tokens", 0)
+
+@lru_cache(maxsize=1)
+def _get_api_key():
+    """
+    Returns the OpenAI API key, reading Streamlit secrets only once.
+
+    st.secrets parses the secrets TOML under a lock on access, so the value
+    is cached here and shared by both client singletons.
+    """
+    return st.secrets["OPENAI_API_KEY"]
+
+@st.cache_resource(show_spinner=False)
+def _get_client():
+    """
+    Returns a shared OpenAI client, creating it on first use.
+
+    st.cache_resource is Streamlit's home for connection-like singletons:
+    one client (and its keep-alive connection pool) is shared across every
+    session and rerun instead of paying constructor and TLS setup cost
+    per call.
+    """
+    return OpenAI(api_key=_get_api_key())
+
+# Like the semaphores, async clients are kept per running loop: the httpx
+# pool binds its keep-alive connections to the loop that created them, so a
+# client cached across successive asyncio.run loops fails with closed-loop
+# errors when a pooled connection is reused.
+_loop_async_clients = {}
+
+def _get_async_client():
+    """
+    Returns the AsyncOpenAI client for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _loop_async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=_get_api_key())
+        _loop_async_clients[loop] = client
+    return client
+
+async def _cleanup_loop_resources():
+    """
+    Releases the running loop's cached client and semaphore.
+
+    Awaited as the last step of coroutines handed to asyncio.run, so the
+    client's connections close before the loop is torn down and neither
+    cache keeps dead loops alive.
+    """
+    loop = asyncio.get_running_loop()
+    _loop_semaphores.pop(loop, None)
+    client = _loop_async_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+async def _run_with_cleanup(coro):
+    """
+    Awaits coro, then releases the loop's cached resources.
+    """
+    try:
+        return await coro
+    finally:
+        await _cleanup_loop_resources()
+
+# Transient failures (rate limits, timeouts, connection drops) are retried up
+# to three times with exponential backoff instead of failing the whole
+# Streamlit action on the first 429/5xx.
+_RETRY_TRANSIENT = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=16),
+    retry=retry_if_exception_type(
+        (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)
+    ),
+    reraise=True,
+)
+
+@_RETRY_TRANSIENT
+def _create_completion(**kwargs):
+    """
+    Issues a chat completion on the shared client, retrying transient errors.
+    """
+    return _get_client().chat.completions.create(**kwargs)
+
+@_RETRY_TRANSIENT
+async def _acreate_completion(**kwargs):
+    """
+    Async counterpart of _create_completion, throttled by the token bucket.
+    """
+    await _RATE_LIMITER.acquire(_estimate_request_tokens(kwargs))
+    return await _get_async_client().chat.completions.create(**kwargs)
+
+# On-disk response cache. st.cache_data lives in process memory, so a
+# Streamlit restart forgets every memoized response; this SQLite layer keyed
+# by a hash of the full request survives restarts and is shared by every
+# session on the host. Set LLM_CACHE_BUST=1 to clear it on startup, or point
+# LLM_CACHE_DIR somewhere else.
+_LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+_DISK_CACHE_LOCK = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _get_disk_cache():
+    """
+    Returns the shared SQLite connection for the response cache.
+    """
+    os.makedirs(_LLM_CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(
+        os.path.join(_LLM_CACHE_DIR, "responses.db"), check_same_thread=False
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, content TEXT NOT NULL, created REAL NOT NULL)"
+    )
+    if os.getenv("LLM_CACHE_BUST"):
+        conn.execute("DELETE FROM responses")
+    conn.commit()
+    return conn
+
+def _disk_cache_key(kwargs):
+    """
+    Hashes the full request (model, messages, schema, sampling params) plus
+    the prompt version into a stable cache key.
+    """
+    payload = json.dumps(kwargs, sort_keys=True, default=str)
+    return hashlib.blake2b(
+        f"{PROMPT_VERSION}\0{payload}".encode(), digest_size=16
+    ).hexdigest()
+
+def _disk_cache_get(key):
+    """
+    Returns the cached content for a key, or None on miss or cache error.
+    """
+    try:
+        with _DISK_CACHE_LOCK:
+            row = _get_disk_cache().execute(
+                "SELECT content FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logging.error(f"LLM disk cache read failed: {e}")
+        return None
+
+def _disk_cache_put(key, content):
+    """
+    Stores content under a key; cache errors are logged, never raised.
+    """
+    try:
+        with _DISK_CACHE_LOCK:
+            conn = _get_disk_cache()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, created) VALUES (?, ?, ?)",
+                (key, content, time.time()),
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logging.error(f"LLM disk cache write failed: {e}")
+
+def _disk_cache_delete(key):
+    """
+    Removes a cached entry; cache errors are logged, never raised.
+    """
+    try:
+        with _DISK_CACHE_LOCK:
+            conn = _get_disk_cache()
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+    except sqlite3.Error as e:
+        logging.error(f"LLM disk cache delete failed: {e}")
+
+# Semantic cache. Exact-key caching misses when a user re-submits a title or
+# PICO that differs by a word; embedding the variable prompt text and
+# nearest-neighbour matching above a cosine threshold returns the prior
+# response for near-duplicates too. Entries are kept per request "namespace"
+# (everything except the user message: system prompt, schema, sampling
+# params) so unrelated helpers never cross-hit. In-memory only — exact-key
+# persistence is the SQLite layer's job.
+_EMBED_MODEL = "text-embedding-3-small"
+_SEMANTIC_THRESHOLD = float(os.getenv("LLM_SEMANTIC_THRESHOLD", "0.97"))
+_semantic_cache = {}  # namespace -> ([unit vectors], [contents])
+
+@lru_cache(maxsize=1024)
+def _embed(text):
+    """
+    Returns a unit-norm embedding vector for the given text, memoized.
+    """
+    response = _get_client().embeddings.create(model=_EMBED_MODEL, input=text)
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def _semantic_namespace(kwargs):
+    """
+    Hashes everything except the user message into a semantic-cache bucket.
+    """
+    scoped = {k: v for k, v in kwargs.items() if k != "messages"}
+    scoped["prefix"] = kwargs.get("messages", [])[:-1]
+    return _disk_cache_key(scoped)
+
+def _semantic_lookup(namespace, vector):
+    """
+    Returns the cached content nearest to vector if above threshold, else None.
+    """
+    entry = _semantic_cache.get(namespace)
+    if not entry:
+        return None
+    vectors, contents = entry
+    sims = np.stack(vectors) @ vector
+    best = int(sims.argmax())
+    if sims[best] >= _SEMANTIC_THRESHOLD:
+        return contents[best]
+    return None
+
+def _semantic_store(namespace, vector, content):
+    vectors, contents = _semantic_cache.setdefault(namespace, ([], []))
+    vectors.append(vector)
+    contents.append(content)
+
+def _content_parses(content, kwargs):
+    """
+    Checks that content is valid JSON when the request asked for structured
+    output; free-text requests always pass.
+    """
+    if "response_format" not in kwargs:
+        return True
+    try:
+        json.loads(content)
+        return True
+    except ValueError:
+        return False
+
+def _completion_content(*, force=False, **kwargs):
+    """
+    Returns the completion text for a request, consulting the caches.
+
+    Lookup order: exact-key SQLite (survives restarts), then the in-memory
+    semantic cache for near-duplicate prompts, then a live API call whose
+    result feeds both layers. With force=True both lookups are skipped and
+    the fresh result overwrites the stored entry. Responses are validated
+    before they are stored: caching a truncated structured response would
+    make every later call for the same input fail until the cache is busted.
+    """
+    key = _disk_cache_key(kwargs)
+    if not force:
+        cached = _disk_cache_get(key)
+        if cached is not None:
+            if _content_parses(cached, kwargs):
+                return cached
+            # An entry poisoned before validation existed; drop it and
+            # fall through to a fresh call
+            _disk_cache_delete(key)
+
+    messages = kwargs.get("messages", [])
+    user_text = messages[-1]["content"] if messages else ""
+    namespace = vector = None
+    try:
+        namespace = _semantic_namespace(kwargs)
+        vector = _embed(user_text)
+        if not force:
+            near = _semantic_lookup(namespace, vector)
+            if near is not None:
+                _disk_cache_put(key, near)
+                return near
+    except Exception as e:
+        # The semantic layer is best-effort; embedding failures fall
+        # through to a live call
+        logging.error(f"Semantic cache lookup failed: {e}")
+
+    choice = _create_completion(**kwargs).choices[0]
+    content = choice.message.content.strip()
+    if choice.finish_reason == "length" or not _content_parses(content, kwargs):
+        raise Exception("The completion was cut off by the max_tokens budget.")
+    _disk_cache_put(key, content)
+    if namespace is not None and vector is not None:
+        _semantic_store(namespace, vector, content)
+    return content
+
+def iter_completion_deltas(messages, **kwargs):
+    """
+    Yields content deltas from a streaming chat completion.
+
+    This is the generator form of the streaming path, suitable for feeding
+    directly into st.write_stream; _stream_and_collect builds on it.
+
+    Args:
+        messages (list): Chat messages for the completion.
+
+    Yields:
+        str: Each non-empty content delta as it arrives.
+    """
+    stream = _create_completion(messages=messages, stream=True, **kwargs)
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+def _stream_and_collect(messages, placeholder=None, render=None, **kwargs):
+    """
+    Streams a chat completion and returns the full text once it completes.
+
+    When a Streamlit placeholder is given, partial output is painted into it
+    as it arrives, so the user sees progress instead of a blank spinner for
+    the whole decode. A render callable maps the accumulated text to the
+    markdown to paint, letting structured-output calls show a readable
+    digest instead of raw JSON; without one the text is painted as-is.
+
+    Args:
+        messages (list): Chat messages for the completion.
+        placeholder: An st.empty() placeholder to update incrementally, or None.
+        render: Optional callable mapping accumulated text to display markdown.
+
+    Returns:
+        str: The accumulated completion text, stripped.
+    """
+    buffer = []
+    pending = ""
+    painted = None
+    for delta in iter_completion_deltas(messages, **kwargs):
+        buffer.append(delta)
+        if placeholder is not None:
+            pending += delta
+            # Throttle repaints; structured outputs stream without newlines,
+            # so flush on accumulated length as well as completed lines
+            if '\n' in pending or len(pending) >= 48:
+                text = "".join(buffer)
+                update = render(text) if render is not None else text
+                if update != painted:
+                    placeholder.markdown(update)
+                    painted = update
+                pending = ""
+    text = "".join(buffer).strip()
+    if placeholder is not None:
+        placeholder.markdown(render(text) if render is not None else text)
+    return text
+
+# Compiled once at import; parse_pico and friends run these on every line of
+# every response, so per-call re.compile/cache-lookup overhead adds up.
+_MD = re.compile(r'\*\*|__')
+_PICO_LINE = re.compile(r'^(Population|Intervention|Comparison|Outcome)\s*:\s*(.*)', re.IGNORECASE)
+_MARKER_RE = re.compile(r'^\s*(?:[-*\u2022]\s*)?(?:\d+\s*[.)]\s*)?')
+
+def _strip_leading_markers(line):
+    """
+    Strips leading list markers ('-', '*', bullets, '1.', '2)') from a line.
+    """
+    # Fast path: lines that cannot start with a marker skip the regex engine
+    if line and line[0] not in '-*\u2022 \t0123456789':
+        return line.strip()
+    return _MARKER_RE.sub('', line, count=1).strip()
+
+# System prompts are module constants so the request prefix is byte-identical
+# across calls. OpenAI's server-side prompt cache matches on exact prefixes,
+# so keeping all boilerplate here (and only variable text in the user message)
+# lets repeat requests hit the prefix cache, cutting time-to-first-token and
+# input-token billing.
+_SYS_PICO_FROM_TITLE = (
+    "You are an assistant that extracts PICO elements from research titles. "
+    "Develop and create relevant PICO elements (Population, Intervention, Comparison, Outcome) "
+    "from the research title supplied by the user. "
+    "If the title does not provide enough to complete a PICO; please be create and relevant."
+)
+
+_SYS_REFINE = (
+    "You are an assistant that refines PICO elements for clarity and specificity. "
+    "Refine the PICO elements supplied by the user."
+)
+
+_SYS_CONCEPTS = (
+    "You are an assistant that extracts key concepts from PICO elements. "
+    "From the PICO elements supplied by the user, extract 3 to 6 distinct, "
+    "non-overlapping key concepts for an accurate and effective search strategy "
+    "in databases like PubMed, MEDLINE, Cochrane, CINAHL, and Embase, "
+    "ranked by relevance. If the 'Comparison' is simply 'placebo' or "
+    "'no intervention,' omit it as a key concept."
+)
+
+_SYS_CONCEPTS_AND_TERMS = (
+    "You are an assistant that builds search strategies from PICO elements. "
+    "From the PICO elements supplied by the user, extract 3 to 6 distinct, "
+    "non-overlapping key concepts ranked by relevance (if the 'Comparison' is "
+    "simply 'placebo' or 'no intervention,' omit it), and for each concept "
+    "generate relevant MeSH terms and Text terms to develop a high quality "
+    "search strategy in databases like PubMed, MEDLINE, Cochrane, CINAHL, "
+    "and Embase."
+)
+
+# Batch prompt templates; the static skeleton is built once at import and only
+# the enumerated items are substituted per call.
+_PICO_BATCH_PROMPT = (
+    "Develop and create relevant PICO elements (Population, Intervention, Comparison, Outcome) "
+    "for each of the following research titles:\n\n{titles}\n\n"
+    "If a title does not provide enough to complete a PICO, please be creative and relevant. "
+    "Respond with a JSON object in the following format:\n"
+    '{{"results": [{{"Population": "...", "Intervention": "...", "Comparison": "...", "Outcome": "..."}}]}}\n'
+    "with one entry per title, in the same order as the titles."
+)
+
+_CONCEPTS_BATCH_PROMPT = (
+    "For each of the following sets of PICO elements, extract between 3 to 6 key concepts that are "
+    "highly relevant for developing an accurate and effective search strategy.\n\n"
+    "Ensure that the concepts are distinct and do not overlap unnecessarily. If the 'Comparison' is "
+    "simply 'placebo' or 'no intervention,' omit it as a key concept.\n\n"
+    "{pico_blocks}\n\n"
+    "Respond with a JSON object in the following format:\n"
+    '{{"results": [["concept 1", "concept 2"]]}}\n'
+    "with one list of concepts per PICO set, in the same order as the sets, "
+    "ranked by relevance to defining an accurate search strategy."
+)
+
+_SYS_SEARCH_TERMS = (
+    "You are an assistant that generates MeSH terms and Text terms for medical concepts. "
+    "For each of the concepts supplied by the user, generate a list of relevant MeSH terms "
+    "and Text terms to develop a high quality search strategy."
+)
+
+# Strict response schemas (Structured Outputs). The model is constrained to
+# emit valid JSON matching these shapes, so the generators parse with
+# json.loads instead of the line-oriented regex parsers; those remain for the
+# Batch API output path and as a fallback on malformed responses.
+_PICO_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "pico",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "Population": {"type": "string"},
+                "Intervention": {"type": "string"},
+                "Comparison": {"type": "string"},
+                "Outcome": {"type": "string"},
+            },
+            "required": ["Population", "Intervention", "Comparison", "Outcome"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_CONCEPTS_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "concepts",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "concepts": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                },
+            },
+            "required": ["concepts"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_PICO_BATCH_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "pico_batch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": _PICO_SCHEMA["json_schema"]["schema"],
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_CONCEPTS_BATCH_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "concepts_batch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_SEARCH_TERMS_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "search_terms",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "Concept": {"type": "string"},
+                            "MeSH Terms": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                            },
+                            "Text Terms": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                            },
+                        },
+                        "required": ["Concept", "MeSH Terms", "Text Terms"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_SYS_FULL_STRATEGY = (
+    "You are an assistant that builds systematic-review search strategies. "
+    "From the research title supplied by the user, develop relevant PICO elements "
+    "(Population, Intervention, Comparison, Outcome); refine them for clarity and "
+    "specificity; extract between 3 to 6 distinct key concepts from the refined "
+    "elements (omitting a 'Comparison' that is simply 'placebo' or 'no intervention'), "
+    "ranked by relevance to an accurate search strategy; and for each concept generate "
+    "relevant MeSH terms and Text terms suitable for databases like PubMed, MEDLINE, "
+    "Cochrane, CINAHL, and Embase. "
+    "If the title does not provide enough to complete a PICO; please be create and relevant."
+)
+
+_FULL_STRATEGY_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "full_strategy",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "pico": _PICO_SCHEMA["json_schema"]["schema"],
+                "refined_pico": _PICO_SCHEMA["json_schema"]["schema"],
+                "concepts": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                },
+                "search_terms": _SEARCH_TERMS_SCHEMA["json_schema"]["schema"]["properties"]["results"],
+            },
+            "required": ["pico", "refined_pico", "concepts", "search_terms"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+def _pico_from_output(output):
+    """
+    Decodes a PICO response, falling back to the text parser if needed.
+    """
+    try:
+        return json.loads(output)
+    except ValueError:
+        return parse_pico(output)
+
+def _concepts_from_output(output):
+    """
+    Decodes a concepts response, falling back to the text parser if needed.
+    """
+    try:
+        return json.loads(output)["concepts"]
+    except (ValueError, KeyError):
+        return parse_concepts(output)
+
+def _search_terms_from_output(output, concepts_list):
+    """
+    Decodes a search-terms response, falling back to the text parser if needed.
+    """
+    try:
+        results = json.loads(output)["results"]
+    except (ValueError, KeyError):
+        return parse_search_terms_all(output, concepts_list)
+
+    # Map the model's concept names back to the originals where they match
+    concept_mapping = {concept.lower(): concept for concept in concepts_list}
+    search_terms_dict = {}
+    for entry in results:
+        concept_name = concept_mapping.get(entry["Concept"].lower(), entry["Concept"])
+        search_terms_dict[concept_name] = {
+            'MeSH Terms': entry["MeSH Terms"],
+            'Text Terms': entry["Text Terms"],
+        }
+    return search_terms_dict
+
+def _pico_statement(pico_elements):
+    """
+    Formats PICO elements as the four labeled lines the prompts expect.
+    """
+    return (
+        f"Population: {pico_elements['Population']}\n"
+        f"Intervention: {pico_elements['Intervention']}\n"
+        f"Comparison: {pico_elements['Comparison']}\n"
+        f"Outcome: {pico_elements['Outcome']}"
+    )
+
+def _pico_from_title_messages(title):
+    """
+    Builds the chat messages for generating PICO elements from a title.
+    """
+    return [
+        {
+            "role": "system",
+            "content": _SYS_PICO_FROM_TITLE
+        },
+        {
+            "role": "user",
+            "content": f'"{title}"'
+        }
+    ]
+
+def _refine_pico_messages(pico_elements):
+    """
+    Builds the chat messages for refining a set of PICO elements.
+    """
+    return [
+        {
+            "role": "system",
+            "content": _SYS_REFINE
+        },
+        {
+            "role": "user",
+            "content": _pico_statement(pico_elements)
+        }
+    ]
+
+def _concepts_from_pico_messages(pico_elements):
+    """
+    Builds the chat messages for extracting key concepts from PICO elements.
+    """
+    return [
+        {
+            "role": "system",
+            "content": _SYS_CONCEPTS
+        },
+        {
+            "role": "user",
+            "content": _pico_statement(pico_elements)
+        }
+    ]
+
+def _search_terms_messages(concepts_list):
+    """
+    Builds the chat messages for generating MeSH and Text terms for concepts.
+    """
+    concepts_text = "\n".join(f"{idx}. {concept}" for idx, concept in enumerate(concepts_list, 1))
+    return [
+        {
+            "role": "system",
+            "content": _SYS_SEARCH_TERMS
+        },
+        {
+            "role": "user",
+            "content": concepts_text
+        }
+    ]
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def generate_pico_from_title(title, prompt_version=PROMPT_VERSION, *, model=MODEL):
+    """
+    Generates PICO elements from a given research title using OpenAI's API.
+
+    Args:
+        title (str): The research question title.
+
+    Returns:
+        dict: A dictionary containing the PICO elements.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    # A blank title would still cost a full round-trip; fail fast instead
+    if not (title or "").strip():
+        raise ValueError("A title is required to generate PICO elements.")
+
+    try:
+        # Call the OpenAI API to generate PICO elements
+        pico_output = _completion_content(
+            model=model,
+            messages=_pico_from_title_messages(title),
+            max_tokens=160,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_PICO_SCHEMA,
+        )
+        pico_elements = _pico_from_output(pico_output)
+        return pico_elements
+
+    except Exception as e:
+        logging.error(f"Error in generate_pico_from_title: {e}")
+        raise Exception("An error occurred while generating PICO elements from the title.")
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def refine_pico_elements(pico_elements, prompt_version=PROMPT_VERSION, *, model=MODEL):
+    """
+    Refines the provided PICO elements for clarity and specificity using OpenAI's API.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+
+    Returns:
+        dict: A dictionary containing the refined PICO elements.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    # Nothing to refine; return the input unchanged rather than paying a call
+    if not any(v.strip() for v in pico_elements.values()):
+        return dict(pico_elements)
+
+    try:
+        # Call the OpenAI API to refine PICO elements
+        refined_pico_output = _completion_content(
+            model=model,
+            messages=_refine_pico_messages(pico_elements),
+            max_tokens=160,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_PICO_SCHEMA,
+        )
+        refined_pico_elements = _pico_from_output(refined_pico_output)
+        return refined_pico_elements
+
+    except Exception as e:
+        logging.error(f"Error in refine_pico_elements: {e}")
+        raise Exception("An error occurred while refining the PICO elements.")
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def generate_concepts_from_pico(pico_elements, prompt_version=PROMPT_VERSION, *, model=MODEL):
+    """
+    Generates key concepts from the given PICO elements using OpenAI's API.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+
+    Returns:
+        list: A list of extracted concepts.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    # All-blank PICO elements cannot yield concepts; skip the call
+    if not any(v.strip() for v in pico_elements.values()):
+        return []
+
+    try:
+        concepts_output = _completion_content(
+            model=model,
+            messages=_concepts_from_pico_messages(pico_elements),
+            max_tokens=200,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_CONCEPTS_SCHEMA,
+        )
+        concepts = _concepts_from_output(concepts_output)
+        return concepts
+
+    except Exception as e:
+        logging.error(f"Error in generate_concepts_from_pico: {e}")
+        raise Exception("An error occurred while generating concepts from the PICO elements.")
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def generate_concepts_and_terms(pico_elements, prompt_version=PROMPT_VERSION, *, model=MODEL, force=False):
+    """
+    Generates key concepts and their search terms in a single API call.
+
+    Fusing concept extraction and term generation pays one round-trip and one
+    copy of the shared PICO context instead of 1 + N.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+        force (bool): When True, bypass the response caches and regenerate,
+            overwriting the stored entry.
+
+    Returns:
+        tuple: (concepts, search_terms) where concepts is a list of concept
+            strings and search_terms maps each concept to its 'MeSH Terms'
+            and 'Text Terms' lists.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    if not any(v.strip() for v in pico_elements.values()):
+        return [], {}
+
+    try:
+        content = _completion_content(
+            force=force,
+            model=model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": _SYS_CONCEPTS_AND_TERMS
+                },
+                {
+                    "role": "user",
+                    "content": _pico_statement(pico_elements)
+                }
+            ],
+            # Concepts plus every MeSH/Text term list share this budget, so
+            # it matches the old standalone terms call rather than trying to
+            # predict the concept count up front; a cutoff raises in
+            # _completion_content instead of returning truncated JSON
+            max_tokens=3000,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_SEARCH_TERMS_SCHEMA,
+        )
+
+        entries = json.loads(content)["results"]
+        concepts = [entry['Concept'] for entry in entries]
+        search_terms = {
+            entry['Concept']: {
+                'MeSH Terms': entry['MeSH Terms'],
+                'Text Terms': entry['Text Terms'],
+            }
+            for entry in entries
+        }
+        return concepts, search_terms
+
+    except Exception as e:
+        logging.error(f"Error in generate_concepts_and_terms: {e}")
+        raise Exception("An error occurred while generating concepts and search terms.")
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def generate_full_strategy(title, prompt_version=PROMPT_VERSION):
+    """
+    Generates PICO elements, refined PICO, concepts and search terms from a
+    title in a single API call.
+
+    Fusing the four pipeline stages into one completion pays the request
+    overhead and the shared context once instead of four times, at the cost
+    of a longer single generation.
+
+    Args:
+        title (str): The research question title.
+
+    Returns:
+        dict: A dictionary with 'pico', 'refined_pico', 'concepts' and 'search_terms' keys,
+            shaped like the outputs of the individual generators.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    if not (title or "").strip():
+        raise ValueError("A title is required to generate a search strategy.")
+
+    try:
+        content = _completion_content(
+            model=MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": _SYS_FULL_STRATEGY
+                },
+                {
+                    "role": "user",
+                    "content": f'"{title}"'
+                }
+            ],
+            max_tokens=3000,
+            temperature=0.5,
+            n=1,
+            stop=None,
+            response_format=_FULL_STRATEGY_SCHEMA,
+        )
+
+        output = json.loads(content)
+        return {
+            'pico': output['pico'],
+            'refined_pico': output['refined_pico'],
+            'concepts': output['concepts'],
+            'search_terms': {
+                entry['Concept']: {
+                    'MeSH Terms': entry['MeSH Terms'],
+                    'Text Terms': entry['Text Terms'],
+                }
+                for entry in output['search_terms']
+            },
+        }
+
+    except Exception as e:
+        logging.error(f"Error in generate_full_strategy: {e}")
+        raise Exception("An error occurred while generating the full search strategy.")
+
+def stream_pico_from_title(title, placeholder=None):
+    """
+    Streaming variant of generate_pico_from_title.
+
+    Args:
+        title (str): The research question title.
+        placeholder: An st.empty() placeholder to update as lines arrive, or None.
+
+    Returns:
+        dict: A dictionary containing the PICO elements.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    try:
+        pico_output = _stream_and_collect(
+            _pico_from_title_messages(title),
+            placeholder,
+            model=MODEL,
+            max_tokens=160,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_PICO_SCHEMA,
+        )
+        return _pico_from_output(pico_output)
+
+    except Exception as e:
+        logging.error(f"Error in stream_pico_from_title: {e}")
+        raise Exception("An error occurred while generating PICO elements from the title.")
+
+def stream_refined_pico_elements(pico_elements, placeholder=None):
+    """
+    Streaming variant of refine_pico_elements.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+        placeholder: An st.empty() placeholder to update as lines arrive, or None.
+
+    Returns:
+        dict: A dictionary containing the refined PICO elements.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    try:
+        refined_pico_output = _stream_and_collect(
+            _refine_pico_messages(pico_elements),
+            placeholder,
+            model=MODEL,
+            max_tokens=160,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_PICO_SCHEMA,
+        )
+        return _pico_from_output(refined_pico_output)
+
+    except Exception as e:
+        logging.error(f"Error in stream_refined_pico_elements: {e}")
+        raise Exception("An error occurred while refining the PICO elements.")
+
+def stream_concepts_from_pico(pico_elements, placeholder=None):
+    """
+    Streaming variant of generate_concepts_from_pico.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+        placeholder: An st.empty() placeholder to update as lines arrive, or None.
+
+    Returns:
+        list: A list of extracted concepts.
+
+    Raises:
+        Exception: If an error occurs during the API call.
     """
-    Generates PICO elements from a given research title using OpenAI's API.
+    try:
+        concepts_output = _stream_and_collect(
+            _concepts_from_pico_messages(pico_elements),
+            placeholder,
+            model=MODEL,
+            max_tokens=200,
+            temperature=0,
+            n=1,
+            stop=None,
+            response_format=_CONCEPTS_SCHEMA,
+        )
+        return _concepts_from_output(concepts_output)
+
+    except Exception as e:
+        logging.error(f"Error in stream_concepts_from_pico: {e}")
+        raise Exception("An error occurred while generating concepts from the PICO elements.")
+
+def stream_search_terms_all(concepts_list, placeholder=None):
+    """
+    Streaming variant of generate_search_terms_all.
 
     Args:
-        title (str): The research question title.
+        concepts_list (list): A list of concept strings.
+        placeholder: An st.empty() placeholder to update as lines arrive, or None.
 
     Returns:
-        dict: A dictionary containing the PICO elements.
+        dict: A dictionary with concept texts as keys, and each value is a dict with 'MeSH Terms' and 'Text Terms' lists.
 
     Raises:
         Exception: If an error occurs during the API call.
     """
     try:
-        client = OpenAI()
-        # Ensure OpenAI API key is set from Streamlit secrets
-        client.api_key = st.secrets["OPENAI_API_KEY"]  # Securely fetch the API key
-        
-        # Construct the AI prompt
-        prompt = (
-            f"Develop and create relevant PICO elements (Population, Intervention, Comparison, Outcome) "
-            f"from the following research title:\n\n\"{title}\"\n\n"
-            f"If the title does not provide enough to complete a PICO; please be create and relevant."
-            f"Provide each element labeled accordingly, and only provide the PICO elements "
-            f"in the following format:\n\n"
-            f"Population: Population\n"
-            f"Intervention: Intervention\n"
-            f"Comparison: Comparison\n"
-            f"Outcome: Outcome"
+        terms_output = _stream_and_collect(
+            _search_terms_messages(concepts_list),
+            placeholder,
+            model=MODEL,
+            max_tokens=160 * max(len(concepts_list), 1),
+            temperature=0.3,
+            n=1,
+            stop=None,
+            response_format=_SEARCH_TERMS_SCHEMA,
         )
-        
-        # Call the OpenAI API to generate PICO elements
-        response = client.chat.completions.create(
-            model='gpt-4o',  # Use the desired model
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an assistant that extracts PICO elements from research titles."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            max_tokens=500,
+        return _search_terms_from_output(terms_output, concepts_list)
+
+    except Exception as e:
+        logging.error(f"Error in stream_search_terms_all: {e}")
+        raise Exception("An error occurred while generating search terms.")
+
+# Matches a labeled PICO field whose value is already complete (closing
+# quote seen) in the partial strict-JSON stream
+_PARTIAL_FIELD_RE = re.compile(
+    r'"(Population|Intervention|Comparison|Outcome)"\s*:\s*"((?:[^"\\]|\\.)*)"'
+)
+
+def _render_strategy_progress(partial):
+    """
+    Renders in-flight full-strategy JSON as readable progress markdown.
+
+    The raw stream is strict JSON, which is noise to the user; this pulls
+    out the PICO fields as they complete and reports coarse progress for
+    the later sections.
+    """
+    lines = []
+    seen = set()
+    for match in _PARTIAL_FIELD_RE.finditer(partial):
+        label = match.group(1)
+        if label in seen:
+            continue  # refined_pico repeats the keys; keep the first pass
+        seen.add(label)
+        lines.append(f"**{label}:** " + match.group(2).replace('\\"', '"'))
+    concept_count = partial.count('"Concept"')
+    if concept_count:
+        lines.append(f"_Generating search terms\u2026 ({concept_count} concepts)_")
+    elif '"concepts"' in partial:
+        lines.append("_Extracting concepts\u2026_")
+    elif not lines:
+        return "_Generating\u2026_"
+    return "  \n".join(lines)
+
+def stream_full_strategy(title, placeholder=None, *, force=False):
+    """
+    Streaming variant of generate_full_strategy.
+
+    Total wall-clock matches the blocking call, but tokens paint into the
+    placeholder as they arrive, so the user sees output within a few hundred
+    milliseconds instead of staring at a spinner for the whole generation.
+    The disk cache is shared with the blocking variant: a prior answer
+    (streamed or not) returns immediately with nothing to stream.
+
+    Args:
+        title (str): The research question title.
+        placeholder: An st.empty() placeholder to update as lines arrive, or None.
+        force: When True, skip the cache lookup and regenerate.
+
+    Returns:
+        dict: Same shape as generate_full_strategy.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    if not (title or "").strip():
+        raise ValueError("A title is required to generate a search strategy.")
+
+    try:
+        messages = [
+            {
+                "role": "system",
+                "content": _SYS_FULL_STRATEGY
+            },
+            {
+                "role": "user",
+                "content": f'"{title}"'
+            }
+        ]
+        # Mirror the blocking variant's kwargs exactly so both share one
+        # disk-cache key
+        kwargs = dict(
+            model=MODEL,
+            messages=messages,
+            max_tokens=3000,
             temperature=0.5,
             n=1,
             stop=None,
+            response_format=_FULL_STRATEGY_SCHEMA,
         )
+        key = _disk_cache_key(kwargs)
+        content = None if force else _disk_cache_get(key)
+        output = None
+        if content is not None:
+            try:
+                output = json.loads(content)
+            except ValueError:
+                # An entry poisoned before validation existed; drop it
+                # and regenerate
+                _disk_cache_delete(key)
+        if output is None:
+            content = _stream_and_collect(messages, placeholder,
+                                          render=_render_strategy_progress, **{
+                k: v for k, v in kwargs.items() if k != "messages"
+            })
+            # Parse before caching: a truncated response raises here
+            # instead of poisoning the disk entry for this title
+            output = json.loads(content)
+            _disk_cache_put(key, content)
 
-        # Extract the AI's reply from the response
-        pico_output = response.choices[0].message.content.strip()
-        pico_elements = parse_pico(pico_output)
-        return pico_elements
+        return {
+            'pico': output['pico'],
+            'refined_pico': output['refined_pico'],
+            'concepts': output['concepts'],
+            'search_terms': {
+                entry['Concept']: {
+                    'MeSH Terms': entry['MeSH Terms'],
+                    'Text Terms': entry['Text Terms'],
+                }
+                for entry in output['search_terms']
+            },
+        }
 
     except Exception as e:
-        logging.error(f"Error in generate_pico_from_title: {e}")
-        raise Exception("An error occurred while generating PICO elements from the title.")
+        logging.error(f"Error in stream_full_strategy: {e}")
+        raise Exception("An error occurred while generating the full search strategy.")
+
+# Flex processing is only offered for the reasoning (o-series) models; other
+# models reject the parameter outright, so it is attached conditionally.
+_FLEX_MODEL_PREFIXES = ("o3", "o4")
 
-def refine_pico_elements(pico_elements):
+def _service_tier_kwargs(model):
     """
-    Refines the provided PICO elements for clarity and specificity using OpenAI's API.
+    Returns a service_tier kwarg for models that support flex processing.
+    """
+    if model.startswith(_FLEX_MODEL_PREFIXES):
+        # Batch calls are non-interactive, so trade latency for cost
+        return {"service_tier": "flex"}
+    return {}
+
+def generate_pico_batch(titles):
+    """
+    Generates PICO elements for several research titles in a single API call.
+
+    Batching the titles into one prompt cuts the number of round-trips from
+    N to 1 compared with calling generate_pico_from_title once per title.
 
     Args:
-        pico_elements (dict): A dictionary containing the PICO elements.
+        titles (list): A list of research question titles.
 
     Returns:
-        dict: A dictionary containing the refined PICO elements.
+        list: A list of dictionaries, one per title, each containing the PICO elements.
 
     Raises:
         Exception: If an error occurs during the API call.
     """
-    try:       
-        client = OpenAI()
-        # Ensure OpenAI API key is set from Streamlit secrets
-        client.api_key = st.secrets["OPENAI_API_KEY"]  # Securely fetch the API key
-
-        # Prepare the PICO statement
-        pico_statement = (
-            f"Population: {pico_elements['Population']}\n"
-            f"Intervention: {pico_elements['Intervention']}\n"
-            f"Comparison: {pico_elements['Comparison']}\n"
-            f"Outcome: {pico_elements['Outcome']}"
-        )
-
-        # Construct the AI prompt
-        prompt = (
-            f"Refine the following PICO elements for clarity and specificity. "
-            f"Provide each element labeled accordingly, and only provide the PICO elements "
-            f"in the following format:\n\n"
-            f"Population: Refined Population\n"
-            f"Intervention: Refined Intervention\n"
-            f"Comparison: Refined Comparison\n"
-            f"Outcome: Refined Outcome\n\n"
-            f"PICO Elements:\n"
-            f"Population: {pico_elements['Population']}\n"
-            f"Intervention: {pico_elements['Intervention']}\n"
-            f"Comparison: {pico_elements['Comparison']}\n"
-            f"Outcome: {pico_elements['Outcome']}"
-        )
+    try:
+        # Enumerate the titles so the model can answer per item
+        titles_text = "\n".join(f"{idx+1}. {title}" for idx, title in enumerate(titles))
+        prompt = _PICO_BATCH_PROMPT.format(titles=titles_text)
 
-        # Call the OpenAI API to refine PICO elements
-        response = client.chat.completions.create(
-            model='gpt-4o',
+        # One call covers every title; the JSON response format keeps parsing trivial
+        response = _create_completion(
+            model=MODEL,
             messages=[
                 {
                     "role": "system",
-                    "content": "You are an assistant that refines PICO elements for clarity and specificity."
+                    "content": "You are an assistant that extracts PICO elements from research titles."
                 },
                 {
                     "role": "user",
                     "content": prompt
                 }
             ],
-            max_tokens=500,
-            temperature=0.5,
+            max_tokens=160 * max(len(titles), 1),
+            temperature=0,
             n=1,
             stop=None,
+            response_format=_PICO_BATCH_SCHEMA,
+            **_service_tier_kwargs(MODEL),
         )
 
         # Extract the AI's reply from the response
-        refined_pico_output = response.choices[0].message.content.strip()
-        refined_pico_elements = parse_pico(refined_pico_output)
-        return refined_pico_elements
+        batch_output = response.choices[0].message.content.strip()
+        return json.loads(batch_output)["results"]
 
     except Exception as e:
-        logging.error(f"Error in refine_pico_elements: {e}")
-        raise Exception("An error occurred while refining the PICO elements.")
+        logging.error(f"Error in generate_pico_batch: {e}")
+        raise Exception("An error occurred while generating PICO elements for the batch of titles.")
 
-def generate_concepts_from_pico(pico_elements):
+def generate_concepts_batch(pico_elements_list):
     """
-    Generates key concepts from the given PICO elements using OpenAI's API.
+    Generates key concepts for several sets of PICO elements in a single API call.
 
     Args:
-        pico_elements (dict): A dictionary containing the PICO elements.
+        pico_elements_list (list): A list of dictionaries, each containing PICO elements.
 
     Returns:
-        list: A list of extracted concepts.
+        list: A list of concept lists, one per PICO set, in the same order.
 
     Raises:
         Exception: If an error occurs during the API call.
     """
     try:
-        client = OpenAI()
-        # Ensure OpenAI API key is set from Streamlit secrets
-        client.api_key = st.secrets["OPENAI_API_KEY"]  # Securely fetch the API key
-
-        # Construct the AI prompt
-        prompt = (
-            f"From the following PICO elements, extract between 3 to 6 key concepts that are highly relevant for developing an accurate and effective search strategy.\n\n"
-            f"Ensure that the concepts are distinct and do not overlap unnecessarily. If the 'Comparison' is simply 'placebo' or 'no intervention,' omit it as a key concept.\n\n"
-            f"Consider relevant search concepts and text words for developing search terms in databases like PubMed, MEDLINE, Cochrane, CINAHL, and Embase.\n\n"
-            f"Population: {pico_elements['Population']}\n"
-            f"Intervention: {pico_elements['Intervention']}\n"
-            f"Comparison: {pico_elements['Comparison']}\n"
-            f"Outcome: {pico_elements['Outcome']}\n\n"
-            f"Provide the concepts as a numbered list, and rank them in terms of their relevance to defining an accurate search strategy."
+        # Enumerate the PICO sets so the model can answer per item
+        pico_blocks = "\n\n".join(
+            f"{idx+1}.\n"
+            f"Population: {pico['Population']}\n"
+            f"Intervention: {pico['Intervention']}\n"
+            f"Comparison: {pico['Comparison']}\n"
+            f"Outcome: {pico['Outcome']}"
+            for idx, pico in enumerate(pico_elements_list)
         )
 
-        response = client.chat.completions.create(
-            model='gpt-4o',  # Use the desired model
+        prompt = _CONCEPTS_BATCH_PROMPT.format(pico_blocks=pico_blocks)
+
+        # One call covers every PICO set; the JSON response format keeps parsing trivial
+        response = _create_completion(
+            model=MODEL,
             messages=[
                 {
                     "role": "system",
@@ -176,22 +1360,116 @@ def generate_concepts_from_pico(pico_elements):
                     "content": prompt
                 }
             ],
-            max_tokens=500,
-            temperature=0.5,
+            max_tokens=200 * max(len(pico_elements_list), 1),
+            temperature=0,
             n=1,
             stop=None,
+            response_format=_CONCEPTS_BATCH_SCHEMA,
+            **_service_tier_kwargs(MODEL),
         )
 
         # Extract the AI's reply from the response
-        concepts_output = response.choices[0].message.content.strip()
-        concepts = parse_concepts(concepts_output)
-        return concepts
+        batch_output = response.choices[0].message.content.strip()
+        return json.loads(batch_output)["results"]
 
     except Exception as e:
-        logging.error(f"Error in generate_concepts_from_pico: {e}")
-        raise Exception("An error occurred while generating concepts from the PICO elements.")
+        logging.error(f"Error in generate_concepts_batch: {e}")
+        raise Exception("An error occurred while generating concepts for the batch of PICO elements.")
+
+def submit_pico_batch(titles):
+    """
+    Submits a bulk PICO-generation job through the OpenAI Batch API.
+
+    For non-interactive workloads (e.g. a CSV of titles) the Batch API
+    processes every request asynchronously at roughly half the cost of
+    synchronous calls, with a 24-hour completion window. Prefer this over
+    generate_pico_batch once len(titles) exceeds BATCH_API_THRESHOLD.
 
-def generate_search_terms_all(concepts_list):
+    Args:
+        titles (list): A list of research question titles.
+
+    Returns:
+        str: The batch job id, to pass to fetch_pico_batch.
+
+    Raises:
+        Exception: If an error occurs while submitting the batch.
+    """
+    try:
+        client = _get_client()
+
+        # One JSONL line per title, in the Batch API request envelope
+        lines = []
+        for idx, title in enumerate(titles):
+            request = {
+                "custom_id": f"pico-{idx}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": MODEL,
+                    "messages": _pico_from_title_messages(title),
+                    "response_format": _PICO_SCHEMA,
+                    "max_tokens": 160,
+                    "temperature": 0,
+                },
+            }
+            lines.append(json.dumps(request))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        batch_file = client.files.create(
+            file=("pico_batch.jsonl", payload),
+            purpose="batch",
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    except Exception as e:
+        logging.error(f"Error in submit_pico_batch: {e}")
+        raise Exception("An error occurred while submitting the PICO batch job.")
+
+def fetch_pico_batch(batch_id):
+    """
+    Fetches the results of a batch job submitted with submit_pico_batch.
+
+    Args:
+        batch_id (str): The batch job id returned by submit_pico_batch.
+
+    Returns:
+        dict: A mapping of custom_id to parsed PICO dictionaries, or None if
+            the batch has not completed yet.
+
+    Raises:
+        Exception: If the batch failed or an error occurs while fetching results.
+    """
+    try:
+        client = _get_client()
+
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise Exception(f"Batch job {batch_id} ended with status '{batch.status}'.")
+        if batch.status != "completed":
+            return None  # Caller should poll again later
+
+        output = client.files.content(batch.output_file_id).text
+        results = {}
+        for line in output.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            content = record["response"]["body"]["choices"][0]["message"]["content"].strip()
+            results[record["custom_id"]] = _pico_from_output(content)
+        return results
+
+    except Exception as e:
+        logging.error(f"Error in fetch_pico_batch: {e}")
+        raise Exception("An error occurred while fetching the PICO batch results.")
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def generate_search_terms_all(concepts_list, prompt_version=PROMPT_VERSION, *, model=MODEL):
     """
     Generates MeSH terms and Text terms for all concepts using OpenAI's API.
 
@@ -204,47 +1482,36 @@ def generate_search_terms_all(concepts_list):
     Raises:
         Exception: If an error occurs during the API call.
     """
+    # No concepts, no terms — and no round-trip
+    concepts_list = [c for c in concepts_list if c.strip()]
+    if not concepts_list:
+        return {}
+
     try:
-        client = OpenAI()
-        # Ensure OpenAI API key is set from Streamlit secrets
-        client.api_key = st.secrets["OPENAI_API_KEY"]  # Securely fetch the API key
-
-        # Construct the AI prompt
-        concepts_text = "\n".join([f"{idx+1}. {concept}" for idx, concept in enumerate(concepts_list)])
-        prompt = (
-            f"For each of the following concepts, generate a list of relevant MeSH terms and Text terms to develop a high quality search strategy.\n"
-            f"Provide the terms for each concept in the following format:\n\n"
-            f"Concept: Concept Name\n"
-            f"MeSH Terms:\n- MeSH term 1\n- MeSH term 2\n...\n"
-            f"Text Terms:\n- Text term 1\n- Text term 2\n...\n\n"
-            f"Here are the concepts:\n{concepts_text}\n\n"
-            f"Please ensure that the output is properly formatted as specified."
-        )
+        # With several concepts, fan out one request per concept and run them
+        # concurrently instead of decoding one combined response serially
+        if len(concepts_list) > 1:
+            return asyncio.run(
+                _run_with_cleanup(
+                    agenerate_search_terms_parallel(list(concepts_list), model=model)
+                )
+            )
 
         # Call the OpenAI API to generate the terms
-        response = client.chat.completions.create(
-            model='gpt-4o',  # Use the desired model
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an assistant that generates MeSH terms and Text terms for medical concepts."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            max_tokens=3000,
+        response = _create_completion(
+            model=model,
+            messages=_search_terms_messages(concepts_list),
+            max_tokens=160 * max(len(concepts_list), 1),
             temperature=0.3,
             n=1,
             stop=None,
+            response_format=_SEARCH_TERMS_SCHEMA,
         )
 
         # Extract the AI's reply from the response
         terms_output = response.choices[0].message.content.strip()
-    
-        # Parse the output, passing the original concepts list
-        search_terms_dict = parse_search_terms_all(terms_output, concepts_list)
+
+        search_terms_dict = _search_terms_from_output(terms_output, concepts_list)
         return search_terms_dict
 
     except Exception as e:
@@ -253,7 +1520,224 @@ def generate_search_terms_all(concepts_list):
 
 
 
+##########################ASYNC######VARIANTS############################################
+async def agenerate_pico_from_title(title):
+    """
+    Async variant of generate_pico_from_title.
+
+    Args:
+        title (str): The research question title.
+
+    Returns:
+        dict: A dictionary containing the PICO elements.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    if not (title or "").strip():
+        raise ValueError("A title is required to generate PICO elements.")
+
+    try:
+        async with _get_request_semaphore():
+            response = await _acreate_completion(
+                model=MODEL,
+                messages=_pico_from_title_messages(title),
+                max_tokens=160,
+                temperature=0,
+                n=1,
+                stop=None,
+                response_format=_PICO_SCHEMA,
+            )
+        pico_output = response.choices[0].message.content.strip()
+        return _pico_from_output(pico_output)
+
+    except Exception as e:
+        logging.error(f"Error in agenerate_pico_from_title: {e}")
+        raise Exception("An error occurred while generating PICO elements from the title.")
+
+async def arefine_pico_elements(pico_elements):
+    """
+    Async variant of refine_pico_elements.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+
+    Returns:
+        dict: A dictionary containing the refined PICO elements.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    if not any(v.strip() for v in pico_elements.values()):
+        return dict(pico_elements)
+
+    try:
+        async with _get_request_semaphore():
+            response = await _acreate_completion(
+                model=MODEL,
+                messages=_refine_pico_messages(pico_elements),
+                max_tokens=160,
+                temperature=0,
+                n=1,
+                stop=None,
+                response_format=_PICO_SCHEMA,
+            )
+        refined_pico_output = response.choices[0].message.content.strip()
+        return _pico_from_output(refined_pico_output)
+
+    except Exception as e:
+        logging.error(f"Error in arefine_pico_elements: {e}")
+        raise Exception("An error occurred while refining the PICO elements.")
+
+async def agenerate_concepts_from_pico(pico_elements):
+    """
+    Async variant of generate_concepts_from_pico.
+
+    Args:
+        pico_elements (dict): A dictionary containing the PICO elements.
+
+    Returns:
+        list: A list of extracted concepts.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    if not any(v.strip() for v in pico_elements.values()):
+        return []
+
+    try:
+        async with _get_request_semaphore():
+            response = await _acreate_completion(
+                model=MODEL,
+                messages=_concepts_from_pico_messages(pico_elements),
+                max_tokens=200,
+                temperature=0,
+                n=1,
+                stop=None,
+                response_format=_CONCEPTS_SCHEMA,
+            )
+        concepts_output = response.choices[0].message.content.strip()
+        return _concepts_from_output(concepts_output)
+
+    except Exception as e:
+        logging.error(f"Error in agenerate_concepts_from_pico: {e}")
+        raise Exception("An error occurred while generating concepts from the PICO elements.")
+
+async def agenerate_search_terms_all(concepts_list):
+    """
+    Async variant of generate_search_terms_all.
+
+    Args:
+        concepts_list (list): A list of concept strings.
+
+    Returns:
+        dict: A dictionary with concept texts as keys, and each value is a dict with 'MeSH Terms' and 'Text Terms' lists.
+
+    Raises:
+        Exception: If an error occurs during the API call.
+    """
+    concepts_list = [c for c in concepts_list if c.strip()]
+    if not concepts_list:
+        return {}
+
+    try:
+        async with _get_request_semaphore():
+            response = await _acreate_completion(
+                model=MODEL,
+                messages=_search_terms_messages(concepts_list),
+                max_tokens=160 * max(len(concepts_list), 1),
+                temperature=0.3,
+                n=1,
+                stop=None,
+                response_format=_SEARCH_TERMS_SCHEMA,
+            )
+        terms_output = response.choices[0].message.content.strip()
+        return _search_terms_from_output(terms_output, concepts_list)
+
+    except Exception as e:
+        logging.error(f"Error in agenerate_search_terms_all: {e}")
+        raise Exception("An error occurred while generating search terms.")
+
+async def agenerate_search_terms_parallel(concepts_list, *, model=MODEL):
+    """
+    Generates search terms with one concurrent request per concept.
+
+    A single batched prompt decodes every concept's terms serially; issuing
+    one small request per concept and gathering them overlaps the network
+    and decode latency, so wall time approaches that of a single concept.
+
+    Args:
+        concepts_list (list): A list of concept strings.
+
+    Returns:
+        dict: A dictionary with concept texts as keys, and each value is a dict with 'MeSH Terms' and 'Text Terms' lists.
+
+    Raises:
+        Exception: If an error occurs during any API call.
+    """
+    async def fetch(concept):
+        async with _get_request_semaphore():
+            response = await _acreate_completion(
+                model=model,
+                messages=_search_terms_messages([concept]),
+                max_tokens=160,
+                temperature=0.3,
+                n=1,
+                stop=None,
+                response_format=_SEARCH_TERMS_SCHEMA,
+            )
+        output = response.choices[0].message.content.strip()
+        return _search_terms_from_output(output, [concept])
+
+    try:
+        results = await asyncio.gather(*(fetch(concept) for concept in concepts_list))
+        search_terms_dict = {}
+        for result in results:
+            search_terms_dict.update(result)
+        return search_terms_dict
+
+    except Exception as e:
+        logging.error(f"Error in agenerate_search_terms_parallel: {e}")
+        raise Exception("An error occurred while generating search terms.")
+
+async def run_pipeline(title):
+    """
+    Runs the full title -> PICO -> concepts -> search terms pipeline.
+
+    Refinement and concept extraction both depend only on the initial PICO
+    elements, so they are awaited concurrently with asyncio.gather.
+
+    Args:
+        title (str): The research question title.
+
+    Returns:
+        dict: A dictionary with 'pico', 'refined_pico', 'concepts' and 'search_terms' keys.
+
+    Raises:
+        Exception: If an error occurs during any API call.
+    """
+    pico_elements = await agenerate_pico_from_title(title)
+    refined_pico_elements, concepts = await asyncio.gather(
+        arefine_pico_elements(pico_elements),
+        agenerate_concepts_from_pico(pico_elements),
+    )
+    search_terms = await agenerate_search_terms_all(concepts)
+    return {
+        'pico': pico_elements,
+        'refined_pico': refined_pico_elements,
+        'concepts': concepts,
+        'search_terms': search_terms,
+    }
+
+def run_pipeline_sync(title):
+    """
+    Synchronous entry point for run_pipeline, for callers without an event loop.
+    """
+    return asyncio.run(_run_with_cleanup(run_pipeline(title)))
+
 ##########################PARSE######FUNCTIONS###########################################
+_PICO_KEYS = ('Population', 'Intervention', 'Comparison', 'Outcome')
+
 def parse_pico(pico_text):
     """
     Parses PICO elements from a given text.
@@ -264,26 +1748,25 @@ def parse_pico(pico_text):
     Returns:
         dict: A dictionary with PICO elements extracted.
     """
-    import re
-
-    pico_elements = {'Population': '', 'Intervention': '', 'Comparison': '', 'Outcome': ''}
+    if not pico_text:
+        return dict.fromkeys(_PICO_KEYS, '')
 
     # Remove any markdown formatting like ** or __
-    pico_text = re.sub(r'\*\*|__', '', pico_text)
+    pico_text = _MD.sub('', pico_text)
 
-    # Split the text into lines
-    lines = pico_text.strip().split('\n')
-    for line in lines:
-        line = line.strip()
-        # Remove bullet points and leading dashes or asterisks
-        line = re.sub(r'^[-*\s]*', '', line)
+    pico_elements = {}
+    for line in pico_text.splitlines():
+        # Remove bullet points and leading dashes, asterisks and whitespace
+        # with a C-level lstrip instead of a regex substitution
+        line = line.strip().lstrip('-* \t')
         # Match 'Population: ...' (case-insensitive)
-        match = re.match(r'^(Population|Intervention|Comparison|Outcome)\s*:\s*(.*)', line, re.IGNORECASE)
+        match = _PICO_LINE.match(line)
         if match:
-            key = match.group(1).capitalize()
-            value = match.group(2).strip()
-            pico_elements[key] = value
+            pico_elements[match.group(1).capitalize()] = match.group(2).strip()
 
+    # Backfill only the keys the response missed
+    for key in _PICO_KEYS:
+        pico_elements.setdefault(key, '')
     return pico_elements
 
 def parse_concepts(concepts_text):
@@ -296,14 +1779,20 @@ def parse_concepts(concepts_text):
     Returns:
         list: List of concepts.
     """
-    lines = concepts_text.strip().split('\n')
-    concepts = []
-    for line in lines:
-        # Remove numbering and extra spaces
-        concept = re.sub(r'^\d+\.\s*', '', line).strip()
-        if concept:
-            concepts.append(concept)
-    return concepts
+    # Strip bullets, numbering and extra spaces; the walrus keeps the
+    # cleaned line from being computed twice per iteration
+    return [
+        concept
+        for line in (concepts_text or "").splitlines()
+        if (concept := _strip_leading_markers(line))
+    ]
+
+def _normalize_concept(text):
+    """
+    Canonical form for concept matching: markers stripped, lowercased, and
+    interned so repeated lookups compare by pointer instead of re-hashing.
+    """
+    return sys.intern(_strip_leading_markers(text).lower())
 
 def parse_search_terms_all(terms_output, original_concepts):
     """
@@ -316,53 +1805,56 @@ def parse_search_terms_all(terms_output, original_concepts):
     Returns:
         dict: A dictionary with concept texts as keys, and each value is a dict with 'MeSH Terms' and 'Text Terms' lists.
     """
-    import re
-
-    # Ensure consistent line endings
-    terms_output = terms_output.replace('\r\n', '\n').replace('\r', '\n')
-
-    # Split the output into blocks for each concept
-    concept_blocks = re.split(r'\n(?=Concept:)', terms_output, flags=re.IGNORECASE)
     search_terms_dict = {}
 
-    # Build a mapping from lowercased original concept texts to their original form
-    concept_mapping = {concept.lower(): concept for concept in original_concepts}
+    # Build a mapping from normalized original concept texts to their
+    # original form, computed once per call
+    concept_mapping = {_normalize_concept(concept): concept for concept in original_concepts}
 
-    for block in concept_blocks:
-        lines = block.strip().split('\n')
-        concept_name = ''
-        mesh_terms = []
-        text_terms = []
-        current_section = None
-
-        for line in lines:
-            line = line.strip()
-            if re.match(r'^Concept:', line, re.IGNORECASE):
-                concept_name_ai = line[len('Concept:'):].strip()
-                # Map the AI's concept name back to the original concept_text
-                concept_name_lower = concept_name_ai.lower()
-                if concept_name_lower in concept_mapping:
-                    concept_name = concept_mapping[concept_name_lower]
-                else:
-                    # Handle cases where AI's concept name doesn't match
-                    concept_name = concept_name_ai  # Use AI's concept name as is
-            elif re.match(r'^MeSH Terms:', line, re.IGNORECASE):
-                current_section = 'MeSH Terms'
-            elif re.match(r'^Text Terms:', line, re.IGNORECASE):
-                current_section = 'Text Terms'
-            elif line.startswith('-'):
-                term = line[1:].strip()
-                if current_section == 'MeSH Terms':
-                    mesh_terms.append(term)
-                elif current_section == 'Text Terms':
-                    text_terms.append(term)
-            else:
-                continue  # Skip any unrecognized lines
+    # Single pass over the lines: a 'Concept:' header flushes the previous
+    # block, so no lookahead split (and no second split per block) is needed
+    concept_name = ''
+    mesh_terms = []
+    text_terms = []
+    current_section = None
 
+    def flush_block():
         if concept_name:
             search_terms_dict[concept_name] = {
                 'MeSH Terms': mesh_terms,
                 'Text Terms': text_terms
             }
 
+    # splitlines handles \r\n and \r natively, so no normalization copies of
+    # the whole output are needed beforehand
+    for line in terms_output.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        # Classify by the first character before lowercasing anything, so the
+        # common bullet lines never pay a .lower() allocation
+        head = line[0]
+        if head == '-':
+            term = line[1:].strip()
+            if current_section == 'MeSH Terms':
+                mesh_terms.append(term)
+            elif current_section == 'Text Terms':
+                text_terms.append(term)
+        elif head in 'Cc' and line[:8].lower() == 'concept:':
+            flush_block()
+            concept_name_ai = line.partition(':')[2].strip()
+            # Map the AI's concept name back to the original concept_text,
+            # falling back to the AI's name when it doesn't match
+            concept_name = concept_mapping.get(_normalize_concept(concept_name_ai), concept_name_ai)
+            mesh_terms = []
+            text_terms = []
+            current_section = None
+        elif head in 'Mm' and line[:11].lower() == 'mesh terms:':
+            current_section = 'MeSH Terms'
+        elif head in 'Tt' and line[:11].lower() == 'text terms:':
+            current_section = 'Text Terms'
+        else:
+            continue  # Skip any unrecognized lines
+
+    flush_block()
     return search_terms_dict
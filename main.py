@@ -1,17 +1,88 @@
 # main.py
 
 import streamlit as st
-import openai
 import ai_utils  # Importing the AI utilities module
+import hashlib
+import json
 import logging
-import pandas as pd  # Import pandas for data manipulation
-import base64  # For copy to clipboard functionality
+import os
+import uuid
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Set up OpenAI API key securely
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+# Workflow state snapshots. A Streamlit restart wipes session state and with
+# it every generated PICO, concept and term; persisting these keys to disk
+# per session id (carried in the 'sid' query param, so a browser reload keeps
+# it) lets a session resume where it left off without re-paying LLM calls.
+_SNAPSHOT_KEYS = ('completed_steps', 'pico', 'concepts', 'search_terms', 'search_strategy')
+_SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.search_assistant')
+
+def _get_session_id():
+    """
+    Returns this session's snapshot id, minting one into the URL if absent.
+    """
+    session_id = st.query_params.get('sid')
+    if not session_id or not session_id.isalnum():
+        session_id = uuid.uuid4().hex
+        st.query_params['sid'] = session_id
+    return session_id
+
+def restore_snapshot():
+    """
+    Hydrates session state from this session's snapshot, once per session.
+    """
+    if st.session_state.get('snapshot_loaded'):
+        return
+    st.session_state.snapshot_loaded = True
+    try:
+        with open(os.path.join(_SNAPSHOT_DIR, f"{_get_session_id()}.json")) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return  # No snapshot yet, or an unreadable one; start fresh
+    for key in _SNAPSHOT_KEYS:
+        if key in snapshot:
+            st.session_state[key] = snapshot[key]
+
+def clear_snapshot():
+    """
+    Deletes this session's snapshot and mints a fresh sid.
+
+    Without this, a reset is immediately undone: the sid survives the rerun
+    and restore_snapshot rehydrates the state that was just cleared.
+    """
+    try:
+        os.remove(os.path.join(_SNAPSHOT_DIR, f"{_get_session_id()}.json"))
+    except OSError:
+        pass  # No snapshot written yet
+    st.query_params['sid'] = uuid.uuid4().hex
+
+def save_snapshot():
+    """
+    Writes the workflow state to disk, skipping unchanged snapshots.
+
+    Called at the end of main() and of every step fragment: fragment-scoped
+    reruns (refining PICO, editing concepts or terms) never re-enter main(),
+    so in-step edits would otherwise stay unpersisted until the next full
+    rerun.
+    """
+    snapshot = {
+        key: st.session_state[key]
+        for key in _SNAPSHOT_KEYS
+        if key in st.session_state
+    }
+    payload = json.dumps(snapshot, sort_keys=True)
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    if st.session_state.get('snapshot_digest') == digest:
+        return
+    try:
+        os.makedirs(_SNAPSHOT_DIR, exist_ok=True)
+        with open(os.path.join(_SNAPSHOT_DIR, f"{_get_session_id()}.json"), 'w') as f:
+            f.write(payload)
+        st.session_state.snapshot_digest = digest
+    except OSError as e:
+        logging.error(f"Failed to write session snapshot: {e}")
+
 
 def initialize_session_state():
     """
@@ -19,83 +90,113 @@ def initialize_session_state():
     """
     default_keys = {
         'completed_steps': [],
-        'population': '',
-        'intervention': '',
-        'comparison': '',
-        'outcome': '',
+        # One dict for the four PICO fields keeps session-state traffic to a
+        # single key instead of four proxy lookups per rerun
+        'pico': {
+            'Population': '',
+            'Intervention': '',
+            'Comparison': '',
+            'Outcome': '',
+        },
         'pico_generated': False,
         'concepts': [],          # Added for Step 3
         'search_terms': {},      # Added for Step 4
         'search_strategy': '',   # Added for Step 5
     }
     for key, value in default_keys.items():
-        if key not in st.session_state:
-            st.session_state[key] = value
+        st.session_state.setdefault(key, value)
             
-def update_sidebar(steps, placeholder):
+@st.fragment
+def render_sidebar(steps):
     """
-    Updates the sidebar with the navigation steps and their completion status.
+    Renders the sidebar navigation with each step's completion status.
+
+    As a fragment it owns its container, so interactions inside the step
+    fragments never repaint the navigation; it refreshes on the full rerun
+    that accompanies a step transition.
     """
+    # One O(1)-membership snapshot for the scans below
+    completed = frozenset(st.session_state.completed_steps)
+
     # Determine the current step
     for step in steps:
-        if step not in st.session_state.completed_steps:
+        if step not in completed:
             current_step = step
             break
     else:
         current_step = None  # All steps completed
 
-    with placeholder:
-        st.title("Navigation")
-        for step in steps:
-            if step in st.session_state.completed_steps:
-                st.write(f"✅ {step}")
-            elif step == current_step:
-                st.write(f"🟡 {step}")
-            else:
-                st.write(f"⬜ {step}")
+    st.title("Navigation")
+    lines = []
+    for step in steps:
+        if step in completed:
+            lines.append(f"✅ {step}")
+        elif step == current_step:
+            lines.append(f"🟡 {step}")
+        else:
+            lines.append(f"⬜ {step}")
+    # Two trailing spaces force a markdown line break, so all six steps ship
+    # as one element (one websocket delta) instead of six
+    st.markdown("  \n".join(lines))
+
+@st.fragment
+def render_chrome():
+    """
+    Renders the static page chrome.
+
+    The title never changes, so as a fragment it stays out of the DOM diff
+    for everything that reruns inside the step fragments.
+    """
+    st.title("Systematic Review Search Assistant")
 
 def main():
     """
     Main function to run the Streamlit app.
     """
-    # Initialize session state
+    # Initialize session state, then hydrate it from any prior snapshot
     initialize_session_state()
+    restore_snapshot()
 
     # Define the steps
     steps = ["Title", "PICO", "Concept Extraction", "Generate Search Terms", "Construct Search Strategy", "Complete"]
 
-    # Create a placeholder for the sidebar
-    sidebar_placeholder = st.sidebar.container()
-
-    # Update the sidebar
-    update_sidebar(steps, sidebar_placeholder)
+    # Render the navigation fragment into the sidebar
+    with st.sidebar:
+        render_sidebar(steps)
 
     # Main content
-    st.title("Systematic Review Search Assistant")
+    render_chrome()
 
-    # Workflow Control
-    if "Title" not in st.session_state.completed_steps:
+    # Workflow Control. completed_steps stays a list in session state (it
+    # keeps completion order and serializes to the snapshot); the gating
+    # tests run against a frozenset materialized once per rerun.
+    completed = frozenset(st.session_state.completed_steps)
+    if "Title" not in completed:
         step_title_input()
-    elif "PICO" not in st.session_state.completed_steps:
+    elif "PICO" not in completed:
         step_pico_input()
-    elif "Concept Extraction" not in st.session_state.completed_steps:
+    elif "Concept Extraction" not in completed:
         step_concept_extraction()
-    elif "Generate Search Terms" not in st.session_state.completed_steps:
+    elif "Generate Search Terms" not in completed:
         step_generate_search_terms()
-    elif "Construct Search Strategy" not in st.session_state.completed_steps:
+    elif "Construct Search Strategy" not in completed:
         step_construct_search_strategy()
-    elif "Complete" not in st.session_state.completed_steps:
+    elif "Complete" not in completed:
         step_complete()
     else:
         st.success("All steps completed! 🎉")
         # Optionally provide a 'Start Again' button
         if st.button("Start Again 🔄"):
-            # Clear session state and restart
-            for key in st.session_state.keys():
-                del st.session_state[key]
+            # Drop the snapshot first, then clear session state and restart
+            clear_snapshot()
+            st.session_state.clear()
             st.rerun()
 
+    # Checkpoint the workflow state; a no-op when nothing changed
+    save_snapshot()
+
 #STEP 1
+@st.fragment
 def step_title_input():
     """
     Handles the Title Input step.
@@ -110,28 +211,53 @@ def step_title_input():
     with col2:
         generate_pico = st.button("Generate PICO from Title", key="generate_pico")
 
+    # Repeat generations for the same title normally return memoized results;
+    # this forces a fresh API call instead
+    force_regenerate = st.checkbox(
+        "Ignore cached results", key="force_regenerate",
+        help="Clear the memoized response for this title and regenerate from scratch."
+    )
+
     if generate_pico and title_input:
-        with st.spinner("Generating PICO elements from Title..."):
-            try:
-                # Generate PICO elements from the title using OpenAI API
-                pico_elements = ai_utils.generate_pico_from_title(title_input)
-                
-                # Update session state with generated PICO elements
-                st.session_state.population = pico_elements['Population']
-                st.session_state.intervention = pico_elements['Intervention']
-                st.session_state.comparison = pico_elements['Comparison']
-                st.session_state.outcome = pico_elements['Outcome']
-                st.session_state.pico_generated = True
-
-                # Mark step as completed
-                if "Title" not in st.session_state.completed_steps:
-                    st.session_state.completed_steps.append("Title")
-
-                st.success("PICO elements generated from Title. Proceeding to PICO step.")
-                st.rerun()  # Rerun the app
-                
-            except Exception as e:
-                st.error(str(e))
+        # Stream the generation into a placeholder so the first tokens show
+        # up within a few hundred milliseconds instead of a blank spinner
+        stream_placeholder = st.empty()
+        try:
+            # Generate the whole pipeline (PICO, concepts, search terms)
+            # in a single API call; later steps reuse the prefilled
+            # results instead of issuing their own calls
+            strategy = ai_utils.stream_full_strategy(
+                title_input, stream_placeholder, force=force_regenerate
+            )
+            stream_placeholder.empty()
+            pico_elements = strategy['pico']
+
+            # Update session state with generated PICO elements
+            st.session_state.pico = dict(pico_elements)
+            st.session_state.pico_generated = True
+
+            # Prefill the downstream steps; they are dropped again if the
+            # user edits the PICO elements before proceeding
+            st.session_state.concepts = [
+                {'id': idx + 1, 'text': concept}
+                for idx, concept in enumerate(strategy['concepts'])
+            ]
+            st.session_state.search_terms = strategy['search_terms']
+            st.session_state.prefill_pico = dict(pico_elements)
+            # The same call already produced the refined PICO; stash it so
+            # an immediate Refine click needs no second round-trip
+            st.session_state.pico_refined = dict(strategy['refined_pico'])
+
+            # Mark step as completed
+            if "Title" not in st.session_state.completed_steps:
+                st.session_state.completed_steps.append("Title")
+
+            st.success("PICO elements generated from Title. Proceeding to PICO step.")
+            st.rerun()  # Rerun the app
+
+        except Exception as e:
+            stream_placeholder.empty()
+            st.error(str(e))
 
     elif generate_pico and not title_input:
         st.warning("Please enter a title to generate PICO elements. ⚠️")
@@ -143,73 +269,101 @@ def step_title_input():
         st.session_state.pico_generated = False
         st.rerun()
 
+    save_snapshot()
+
 #STEP 2
+@st.fragment
 def step_pico_input():
     """
     Handles the PICO Input step.
     """
     st.header("Step 2: Input PICO Elements")
 
-    # PICO input fields with pre-filled values if available
-    population_input = st.text_area(
-        "Population:", value=st.session_state.population, key="population_input"
-    )
-    intervention_input = st.text_area(
-        "Intervention:", value=st.session_state.intervention, key="intervention_input"
-    )
-    comparison_input = st.text_area(
-        "Comparison:", value=st.session_state.comparison, key="comparison_input"
-    )
-    outcome_input = st.text_area(
-        "Outcome:", value=st.session_state.outcome, key="outcome_input"
-    )
-
-    col1, col2 = st.columns(2)
-    with col1:
-        refine_pico = st.button("Refine using AI 🤖", key="refine_pico")
-    with col2:
-        next_step = st.button("Next ➡️", key="next_step")
+    # The four inputs live in a form, so editing a field no longer triggers
+    # a rerun per widget interaction — only the two submit buttons do, and
+    # both deliver the current field values
+    with st.form("pico_form"):
+        # PICO input fields with pre-filled values if available
+        pico = st.session_state.pico
+        population_input = st.text_area(
+            "Population:", value=pico['Population'], key="population_input"
+        )
+        intervention_input = st.text_area(
+            "Intervention:", value=pico['Intervention'], key="intervention_input"
+        )
+        comparison_input = st.text_area(
+            "Comparison:", value=pico['Comparison'], key="comparison_input"
+        )
+        outcome_input = st.text_area(
+            "Outcome:", value=pico['Outcome'], key="outcome_input"
+        )
+
+        col1, col2 = st.columns(2)
+        with col1:
+            refine_pico = st.form_submit_button("Refine using AI 🤖")
+        with col2:
+            next_step = st.form_submit_button("Next ➡️")
 
     if refine_pico:
-        with st.spinner("Refining PICO elements..."):
-            try:
-                # Prepare PICO elements for refinement
-                pico_elements = {
-                    'Population': population_input,
-                    'Intervention': intervention_input,
-                    'Comparison': comparison_input,
-                    'Outcome': outcome_input
-                }
-
-                # Refine PICO elements using OpenAI API
-                refined_pico_elements = ai_utils.refine_pico_elements(pico_elements)
-
-                # Update session state with refined PICO elements
-                st.session_state.population = refined_pico_elements['Population']
-                st.session_state.intervention = refined_pico_elements['Intervention']
-                st.session_state.comparison = refined_pico_elements['Comparison']
-                st.session_state.outcome = refined_pico_elements['Outcome']
-
-                st.success("PICO elements have been refined. ✅")
-                st.rerun()
-
-            except Exception as e:
-                st.error(str(e))
+        # Prepare PICO elements for refinement
+        pico_elements = {
+            'Population': population_input,
+            'Intervention': intervention_input,
+            'Comparison': comparison_input,
+            'Outcome': outcome_input
+        }
+
+        # A repeat click with unchanged fields is a no-op; skip the spinner
+        # and the API round-trip entirely
+        if pico_elements == st.session_state.get('last_refined_pico'):
+            st.success("PICO elements have been refined. ✅")
+        elif (pico_elements == st.session_state.get('prefill_pico')
+                and st.session_state.get('pico_refined')):
+            # Title -> PICO -> Refine with no edits: the full-strategy call
+            # already returned the refined PICO, so apply it directly. The
+            # prefill marker moves with it, since the prefilled concepts and
+            # terms were derived from the refined elements.
+            refined_pico_elements = st.session_state.pico_refined
+            st.session_state.pico = dict(refined_pico_elements)
+            st.session_state.last_refined_pico = dict(refined_pico_elements)
+            st.session_state.prefill_pico = dict(refined_pico_elements)
+            st.success("PICO elements have been refined. ✅")
+            st.rerun(scope="fragment")
+        else:
+            with st.spinner("Refining PICO elements..."):
+                try:
+                    # Refine PICO elements using OpenAI API
+                    refined_pico_elements = ai_utils.refine_pico_elements(pico_elements)
+
+                    # Update session state with refined PICO elements
+                    st.session_state.pico = dict(refined_pico_elements)
+                    st.session_state.last_refined_pico = dict(refined_pico_elements)
+
+                    st.success("PICO elements have been refined. ✅")
+                    st.rerun(scope="fragment")
+
+                except Exception as e:
+                    st.error(str(e))
 
     elif next_step:
         # Update session state with the inputs
-        st.session_state.population = population_input
-        st.session_state.intervention = intervention_input
-        st.session_state.comparison = comparison_input
-        st.session_state.outcome = outcome_input
+        st.session_state.pico = {
+            'Population': population_input,
+            'Intervention': intervention_input,
+            'Comparison': comparison_input,
+            'Outcome': outcome_input,
+        }
 
         # Ensure all PICO fields are filled
-        if all([
-            st.session_state.population.strip(),
-            st.session_state.intervention.strip(),
-            st.session_state.comparison.strip(),
-            st.session_state.outcome.strip()
-        ]):
+        if all(value.strip() for value in st.session_state.pico.values()):
+            # If the PICO was edited since the full strategy was generated,
+            # the prefilled concepts and search terms are stale — drop them
+            # so the later steps regenerate from the edited PICO
+            prefill_pico = st.session_state.get('prefill_pico')
+            if prefill_pico is not None and st.session_state.pico != prefill_pico:
+                st.session_state.concepts = []
+                st.session_state.search_terms = {}
+
             # Mark PICO step as completed
             if "PICO" not in st.session_state.completed_steps:
                 st.session_state.completed_steps.append("PICO")
@@ -217,7 +371,10 @@ def step_pico_input():
         else:
             st.warning("Please fill in all PICO elements before proceeding. ⚠️")
 
+    save_snapshot()
+
 #STEP 3
+@st.fragment
 def step_concept_extraction():
     """
     Handles the Concept Extraction step with AI integration.
@@ -228,25 +385,39 @@ def step_concept_extraction():
 
     if 'concepts' not in st.session_state or not st.session_state.concepts:
         # Prepare PICO elements
-        pico_elements = {
-            'Population': st.session_state.population,
-            'Intervention': st.session_state.intervention,
-            'Comparison': st.session_state.comparison,
-            'Outcome': st.session_state.outcome
-        }
+        pico_elements = dict(st.session_state.pico)
 
-        # Run the concept AI function
+        # Run the concept AI function; concepts and their search terms come
+        # back from one fused call, so Step 4 starts prefilled instead of
+        # issuing its own round-trip
+        error = None
         try:
             with st.spinner("Generating concepts from PICO elements..."):
-                concepts_list = ai_utils.generate_concepts_from_pico(pico_elements)
-                if not concepts_list:
-                    st.error("No concepts were generated. Please check your PICO elements.")
-                    return
+                concepts_list, search_terms = ai_utils.generate_concepts_and_terms(
+                    pico_elements,
+                    force=st.session_state.pop('concepts_force_regenerate', False),
+                )
+            if concepts_list:
                 # Assign IDs and format as list of dicts
                 st.session_state.concepts = [{'id': idx+1, 'text': concept} for idx, concept in enumerate(concepts_list)]
+                st.session_state.search_terms = dict(search_terms)
+            else:
+                error = "No concepts were generated. Please check your PICO elements."
         except Exception as e:
-            st.error(f"An error occurred while generating concepts: {str(e)}")
-            return  # Exit the function if there's an error
+            error = f"An error occurred while generating concepts: {str(e)}"
+        if error:
+            st.error(error)
+            # Keep the regenerate escape hatch reachable on failure: a
+            # cached-but-broken response errors on every rerun, and this
+            # is the only control that clears the memo and forces a
+            # fresh call
+            if st.button("Regenerate Concepts 🔄", key="concepts_retry"):
+                ai_utils.generate_concepts_and_terms.clear()
+                st.session_state.concepts_force_regenerate = True
+                st.session_state.concepts = []
+                st.session_state.search_terms = {}
+                st.rerun(scope="fragment")
+            return
 
     concepts = st.session_state.concepts
 
@@ -268,13 +439,23 @@ def step_concept_extraction():
                 )
                 if delete:
                     st.session_state.concepts = [c for c in concepts if c['id'] != concept['id']]
-                    st.rerun()
+                    st.rerun(scope="fragment")
 
     # Button to add a new concept
     if st.button("Add Concept ➕"):
         new_id = max([c['id'] for c in st.session_state.concepts] or [0]) + 1
         st.session_state.concepts.append({'id': new_id, 'text': ''})
-        st.rerun()
+        st.rerun(scope="fragment")
+
+    # Button to regenerate concepts from scratch; clears the in-memory
+    # memo and flags the next run to bypass the disk cache too, so it
+    # really does issue a fresh API call
+    if st.button("Regenerate Concepts 🔄"):
+        ai_utils.generate_concepts_and_terms.clear()
+        st.session_state.concepts_force_regenerate = True
+        st.session_state.concepts = []
+        st.session_state.search_terms = {}
+        st.rerun(scope="fragment")
 
     # Navigation buttons
     col1, col2 = st.columns(2)
@@ -296,14 +477,21 @@ def step_concept_extraction():
         if "PICO" in st.session_state.completed_steps:
             st.session_state.completed_steps.remove("PICO")
         st.rerun()
-        
+
+    save_snapshot()
+
 #STEP 4
+@st.fragment
 def step_generate_search_terms():
     """
     Handles the Generate Search Terms step with AI integration.
     """
     st.header("Step 4: Generate Search Terms")
 
+    # Deferred import: pandas is only needed for the term editors in this
+    # step, so cold starts skip its import cost entirely
+    import pandas as pd
+
     st.write("For each concept, here are the MeSH and Text terms generated by AI. You can edit, add, or delete terms as needed.")
 
     if 'search_terms' not in st.session_state:
@@ -337,6 +525,18 @@ def step_generate_search_terms():
     # Update the session state
     st.session_state.search_terms = search_terms
 
+    # Editor frames are kept in session state and rebuilt only when their
+    # backing term list changes, instead of paying 2N DataFrame constructions
+    # and .tolist() round-trips on every rerun
+    def editor_frame(concept_text, kind):
+        frames = st.session_state.setdefault('term_frames', {})
+        terms = search_terms[concept_text][kind]
+        cached = frames.get((concept_text, kind))
+        if cached is None or cached[0] != terms:
+            cached = (list(terms), pd.DataFrame(terms, columns=[kind]))
+            frames[(concept_text, kind)] = cached
+        return cached[1]
+
     # Proceed with displaying the search terms
     # Create tabs for each concept
     concept_tabs = st.tabs(concepts_list)
@@ -349,31 +549,22 @@ def step_generate_search_terms():
             # Split into two columns
             col1, col2 = st.columns(2)
 
-            with col1:
-                # MeSH Terms
-                st.write("**MeSH Terms**")
-                mesh_terms = search_terms[concept_text]['MeSH Terms']
-                mesh_terms_df = pd.DataFrame(mesh_terms, columns=['MeSH Terms'])
-                edited_mesh_terms = st.data_editor(
-                    mesh_terms_df,
-                    num_rows="dynamic",
-                    key=f"mesh_terms_{concept['id']}"
-                )
-                # Update MeSH terms in session state
-                st.session_state.search_terms[concept_text]['MeSH Terms'] = edited_mesh_terms['MeSH Terms'].tolist()
-
-            with col2:
-                # Text Terms
-                st.write("**Text Terms**")
-                text_terms = search_terms[concept_text]['Text Terms']
-                text_terms_df = pd.DataFrame(text_terms, columns=['Text Terms'])
-                edited_text_terms = st.data_editor(
-                    text_terms_df,
-                    num_rows="dynamic",
-                    key=f"text_terms_{concept['id']}"
-                )
-                # Update Text terms in session state
-                st.session_state.search_terms[concept_text]['Text Terms'] = edited_text_terms['Text Terms'].tolist()
+            for column, kind, key_prefix in (
+                (col1, 'MeSH Terms', 'mesh_terms'),
+                (col2, 'Text Terms', 'text_terms'),
+            ):
+                with column:
+                    st.write(f"**{kind}**")
+                    edited_terms_df = st.data_editor(
+                        editor_frame(concept_text, kind),
+                        num_rows="dynamic",
+                        key=f"{key_prefix}_{concept['id']}"
+                    )
+                    # Write back only when the editor actually changed the
+                    # terms; unchanged reruns leave the dict untouched
+                    edited_terms = edited_terms_df[kind].tolist()
+                    if edited_terms != search_terms[concept_text][kind]:
+                        search_terms[concept_text][kind] = edited_terms
 
     # Navigation buttons
     col1, col2 = st.columns(2)
@@ -393,63 +584,73 @@ def step_generate_search_terms():
             st.session_state.completed_steps.remove("Concept Extraction")
         st.rerun()
 
-#STEP 5
-def step_construct_search_strategy():
-    """
-    Handles the Construct Search Strategy step.
+    save_snapshot()
+
+@st.cache_data(show_spinner=False)
+def build_strategy(concepts_tuple, terms_tuple):
     """
-    st.header("Step 5: Construct Search Strategy")
+    Builds the combined search strategy string from frozen inputs.
 
-    st.write("Below is your constructed search strategy. You can make final edits if needed.")
+    Pure and memoized: reruns with unchanged concepts and terms return the
+    assembled string without re-formatting every term expression.
 
-    if 'search_strategy' not in st.session_state or not st.session_state.search_strategy:
-        strategy_components = []
-        for concept in st.session_state.concepts:
-            concept_text = concept['text']
-            terms = st.session_state.search_terms[concept_text]
+    Args:
+        concepts_tuple (tuple): Concept texts in display order.
+        terms_tuple (tuple): One (concept, mesh_terms, text_terms) triple per
+            concept, with the term lists as tuples.
 
-            term_expressions = []
+    Returns:
+        str: The PubMed-style search strategy.
+    """
+    strategy_components = []
+    for concept_text, mesh_terms, text_terms in terms_tuple:
+        term_expressions = []
 
-            # Process MeSH terms
-            for term in terms['MeSH Terms']:
+        for terms, tag in ((mesh_terms, 'MeSH'), (text_terms, 'TIAB')):
+            for term in terms:
                 term = term.strip()
                 # If term already includes a field tag, use as is
                 if '[' in term and ']' in term:
-                    term_expression = term
+                    term_expressions.append(term)
+                # Quote terms containing spaces or special characters
+                elif ' ' in term or '*' in term or '-' in term:
+                    term_expressions.append(f'"{term}"[{tag}]')
                 else:
-                    # Check if term needs quotes (contains spaces or special characters)
-                    if ' ' in term or '*' in term or '-' in term:
-                        term_expression = f'"{term}"[MeSH]'
-                    else:
-                        term_expression = f'{term}[MeSH]'
-                term_expressions.append(term_expression)
-
-            # Process Text terms
-            for term in terms['Text Terms']:
-                term = term.strip()
-                # If term already includes a field tag, use as is
-                if '[' in term and ']' in term:
-                    term_expression = term
-                else:
-                    # Check if term needs quotes
-                    if ' ' in term or '*' in term or '-' in term:
-                        term_expression = f'"{term}"[TIAB]'
-                    else:
-                        term_expression = f'{term}[TIAB]'
-                term_expressions.append(term_expression)
-
-            # Combine terms with 'OR'
-            concept_terms = ' OR '.join(term_expressions)
-            # Wrap in parentheses
-            concept_terms = f'({concept_terms})'
-
-            # Append to strategy components
-            strategy_components.append(concept_terms)
-
-        # Combine all concept terms with ' AND '
-        search_strategy = ' AND '.join(strategy_components)
-        # Save to session state
-        st.session_state.search_strategy = search_strategy
+                    term_expressions.append(f'{term}[{tag}]')
+
+        # Combine terms with 'OR' and wrap in parentheses
+        strategy_components.append(f"({' OR '.join(term_expressions)})")
+
+    # Combine all concept terms with ' AND '
+    return ' AND '.join(strategy_components)
+
+#STEP 5
+@st.fragment
+def step_construct_search_strategy():
+    """
+    Handles the Construct Search Strategy step.
+    """
+    st.header("Step 5: Construct Search Strategy")
+
+    st.write("Below is your constructed search strategy. You can make final edits if needed.")
+
+    # Freeze the inputs; rebuild only when there is no strategy yet or the
+    # concepts/terms changed since it was last assembled (manual edits to the
+    # text area survive reruns otherwise)
+    terms_tuple = tuple(
+        (
+            concept['text'],
+            tuple(st.session_state.search_terms[concept['text']]['MeSH Terms']),
+            tuple(st.session_state.search_terms[concept['text']]['Text Terms']),
+        )
+        for concept in st.session_state.concepts
+    )
+    inputs_changed = st.session_state.get('strategy_inputs') != terms_tuple
+    if not st.session_state.search_strategy or inputs_changed:
+        st.session_state.search_strategy = build_strategy(
+            tuple(entry[0] for entry in terms_tuple), terms_tuple
+        )
+        st.session_state.strategy_inputs = terms_tuple
 
     # Display the search strategy in a large text area
     search_strategy_input = st.text_area(
@@ -483,7 +684,10 @@ def step_construct_search_strategy():
             st.session_state.completed_steps.remove("Generate Search Terms")
         st.rerun()
 
+    save_snapshot()
+
 #STEP 6
+@st.fragment
 def step_complete():
     """
     Handles the Complete step.
@@ -492,37 +696,22 @@ def step_complete():
 
     st.success("Thank you for using the Systematic Review Search Assistant! 🎉")
 
-    # Display the final search strategy
+    # Display the final search strategy; st.code ships its own copy button,
+    # so no per-click script injection or escaping pass is needed
     st.write("Here is your final search strategy:")
-    st.text_area(
-        "Search Strategy:",
-        value=st.session_state.search_strategy,
-        height=300,
-        key="final_search_strategy",
-        disabled=True
-    )
-
-    # Copy button to copy the search strategy to clipboard
-    if st.button("Copy Search Strategy 📋"):
-        # Implement copy to clipboard functionality using JavaScript
-        search_strategy = st.session_state.search_strategy.replace('\n', '\\n').replace("'", "\\'")
-        js = f"""
-        <script>
-        navigator.clipboard.writeText('{search_strategy}');
-        </script>
-        """
-        st.components.v1.html(js, height=0)
-        st.success("Search strategy copied to clipboard!")
+    st.code(st.session_state.search_strategy, language="text")
 
     # 'Start Again' button
     if st.button("Start Again 🔄"):
         # Confirm before starting over
         confirm_reset = st.checkbox("Are you sure you want to start over? All progress will be lost.")
         if confirm_reset:
-            # Clear session state and restart
-            for key in st.session_state.keys():
-                del st.session_state[key]
+            # Drop the snapshot first, then clear session state and restart
+            clear_snapshot()
+            st.session_state.clear()
             st.rerun()
 
+    save_snapshot()
+
 if __name__ == "__main__":
     main()